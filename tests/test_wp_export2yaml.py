@@ -1,5 +1,16 @@
 import pytest
-from wp_converter.wp_export2yaml import parse_wxr2yaml
+import yaml
+import wp_converter.wp_export2yaml as wp_export2yaml
+from wp_converter.wp_export2yaml import (
+    collapse_custom_fields,
+    compile_field_patterns,
+    convert_post_content,
+    dict_to_list_if_sequential,
+    html_paragraphize,
+    parse_wxr2yaml,
+    resolve_attachment_ids,
+    try_php_unserialize,
+)
 
 
 def test_parse_wxr2yaml_runs(tmp_path):
@@ -10,3 +21,213 @@ def test_parse_wxr2yaml_runs(tmp_path):
         parse_wxr2yaml(xml_file, str(yaml_file))
     except Exception as e:
         pytest.fail(f"parse_wxr2yaml raised an exception: {e}")
+
+
+def test_dict_to_list_if_sequential():
+    assert dict_to_list_if_sequential({0: "a", 1: "b"}) == ["a", "b"]
+    # Keys 0..n-1 in any order are ordered by key
+    assert dict_to_list_if_sequential({1: "b", 0: "a"}) == ["a", "b"]
+    # Gaps and string keys are left as dicts
+    assert dict_to_list_if_sequential({0: "a", 2: "c"}) == {0: "a", 2: "c"}
+    assert dict_to_list_if_sequential({"0": "a"}) == {"0": "a"}
+    # Empty PHP arrays are empty lists
+    assert dict_to_list_if_sequential({}) == []
+    # Nested values are converted too
+    assert dict_to_list_if_sequential({0: {0: "x"}, 1: {"k": {0: 1, 1: 2}}}) == [
+        ["x"],
+        {"k": [1, 2]},
+    ]
+    # Non-dict values are returned unchanged
+    assert dict_to_list_if_sequential("a:1") == "a:1"
+
+
+def test_compile_field_patterns():
+    names, regex = compile_field_patterns(["_edit_lock", "_yoast_*", "x[ab]"])
+    assert names == {"_edit_lock"}
+    assert regex.match("_yoast_wpseo_title")
+    assert regex.match("xa")
+    assert not regex.match("xc")
+    assert not regex.match("_edit_lock_extra")
+    assert compile_field_patterns(["_edit_lock"]) == (frozenset({"_edit_lock"}), None)
+
+
+def test_html_paragraphize():
+    assert html_paragraphize("a\n\nb\nc") == "<p>a</p><p>b</p><p>c</p>"
+    assert html_paragraphize("x<br/><br />y<br>\nz") == "<p>x</p><p>y</p><p>z</p>"
+    # Newlines next to tags are left alone
+    assert html_paragraphize("<p>a</p>\n<p>b</p>") == "<p>a</p>\n<p>b</p>"
+
+
+def test_resolve_attachment_ids():
+    attached_files = {"1": "a.jpg", "2": "b.jpg"}
+    post = {"custom_fields": {"galeria": "1, 2", "_thumbnail_id": "2"}}
+    assert resolve_attachment_ids(post, attached_files, allow_missing=False)
+    assert post["custom_fields"] == {
+        "galeria": ["a.jpg", "b.jpg"],
+        "thumbnail": "b.jpg",
+    }
+    # Unless missing IDs are allowed, the post is left untouched
+    post = {"custom_fields": {"galeria": ["1", "3"]}}
+    assert not resolve_attachment_ids(post, attached_files, allow_missing=False)
+    assert post["custom_fields"] == {"galeria": ["1", "3"]}
+    assert resolve_attachment_ids(post, attached_files)
+    assert post["custom_fields"] == {"galeria": ["a.jpg", "3"]}
+    post = {"custom_fields": {"galeria": ""}}
+    assert resolve_attachment_ids(post, attached_files, allow_missing=False)
+    assert post["custom_fields"] == {"galeria": []}
+
+
+def test_try_php_unserialize_scalars():
+    assert try_php_unserialize("i:-12;") == -12
+    assert try_php_unserialize("d:1.5;") == 1.5
+    assert try_php_unserialize("b:1;") is True
+    assert try_php_unserialize("N;") is None
+    # String lengths are in bytes
+    assert try_php_unserialize('s:2:"ñ";') == "ñ"
+    assert try_php_unserialize('s:4:"a";b";') == 'a";b'
+    assert try_php_unserialize('a:1:{i:0;s:1:"x";}') == ["x"]
+
+
+def test_collapse_custom_fields():
+    first = ["a", "b"]
+    assert collapse_custom_fields(
+        {"single": ["x"], "repeated": ["x", "y", "z"], "list_first": [first, "c"]}
+    ) == {"single": "x", "repeated": ["x", "y", "z"], "list_first": ["a", "b", "c"]}
+    # Leading lists are not modified in place
+    assert first == ["a", "b"]
+
+
+def test_parse_wxr2yaml_non_xml_input(tmp_path):
+    xml_file = tmp_path / "export.xml"
+    xml_file.write_text("not xml at all\n")
+    yaml_file = tmp_path / "output.yaml"
+    parse_wxr2yaml(str(xml_file), str(yaml_file))
+    assert yaml_file.read_text() == "[]\n"
+
+
+def _wxr_item(post_id, post_type, content="", postmeta=()):
+    meta = "".join(
+        f"<wp:postmeta><wp:meta_key>{key}</wp:meta_key>"
+        f"<wp:meta_value><![CDATA[{value}]]></wp:meta_value></wp:postmeta>"
+        for key, value in postmeta
+    )
+    return (
+        f"<item><title>Item {post_id}</title>"
+        f"<content:encoded><![CDATA[{content}]]></content:encoded>"
+        f"<wp:post_id>{post_id}</wp:post_id><wp:post_name>item-{post_id}</wp:post_name>"
+        f"<wp:post_type>{post_type}</wp:post_type>"
+        f'<category domain="category" nicename="news"><![CDATA[News]]></category>'
+        f"{meta}</item>"
+    )
+
+
+def _write_wxr(path, items):
+    path.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0"'
+        ' xmlns:content="http://purl.org/rss/1.0/modules/content/"'
+        ' xmlns:wp="http://wordpress.org/export/1.2/">'
+        "<channel>" + "".join(items) + "</channel></rss>",
+        encoding="utf-8",
+    )
+
+
+@pytest.fixture(params=["walk", "iterparse"])
+def parse_mode(request, monkeypatch):
+    if request.param == "iterparse":
+        monkeypatch.setattr(wp_export2yaml, "_XML_WALK_MAX_SIZE", -1)
+    return request.param
+
+
+def test_parse_wxr2yaml_end_to_end(tmp_path, parse_mode):
+    xml_file = tmp_path / "export.xml"
+    _write_wxr(
+        xml_file,
+        [
+            _wxr_item(1, "attachment", postmeta=[("_wp_attached_file", "a.jpg")]),
+            # Content ending in blank lines is emitted as a "|+" block scalar
+            _wxr_item(
+                2,
+                "post",
+                "<p>Hello</p>\n\n",
+                [("_thumbnail_id", "1"), ("notes", "one\ntwo\n\n")],
+            ),
+            # References an attachment that only appears later
+            _wxr_item(3, "post", "Text", [("galeria", "1,4")]),
+            _wxr_item(4, "attachment", postmeta=[("_wp_attached_file", "b.jpg")]),
+            _wxr_item(5, "page", "Page", [("empty", "a:0:{}")]),
+        ],
+    )
+    yaml_file = tmp_path / "output.yaml"
+    parse_wxr2yaml(str(xml_file), str(yaml_file))
+    output = yaml_file.read_text(encoding="utf-8")
+    posts = yaml.safe_load(output)
+    # Multiline values are written as block scalars
+    assert "notes: |+\n" in output
+
+    # Posts are written as parsed, and the deferred post last
+    assert [post["id"] for post in posts] == ["1", "2", "4", "5", "3"]
+    by_id = {post["id"]: post for post in posts}
+    assert by_id["2"]["content"] == "<p>Hello</p>\n\n"
+    assert by_id["2"]["custom_fields"] == {
+        "notes": "one\ntwo\n\n",
+        "thumbnail": "a.jpg",
+    }
+    assert by_id["2"]["taxonomies"] == {"category": [{"name": "News", "slug": "news"}]}
+    assert by_id["3"]["custom_fields"] == {"galeria": ["a.jpg", "b.jpg"]}
+    assert by_id["5"]["custom_fields"] == {"empty": []}
+
+    # Attachments of excluded types still resolve the references
+    parse_wxr2yaml(
+        str(xml_file),
+        str(yaml_file),
+        included_post_types=["post"],
+        convert_to_markdown=True,
+    )
+    posts = yaml.safe_load(yaml_file.read_text(encoding="utf-8"))
+    assert [post["id"] for post in posts] == ["2", "3"]
+    assert posts[0]["content"] == "Hello"
+    assert posts[0]["custom_fields"]["thumbnail"] == "a.jpg"
+    assert posts[1]["custom_fields"]["galeria"] == ["a.jpg", "b.jpg"]
+
+    # Nothing matched
+    parse_wxr2yaml(str(xml_file), str(yaml_file), included_post_types=["product"])
+    assert yaml.safe_load(yaml_file.read_text(encoding="utf-8")) == []
+
+
+def test_parse_wxr2yaml_unreadable_input(tmp_path, capsys):
+    # A directory can't be opened as the export
+    with pytest.raises(SystemExit) as excinfo:
+        parse_wxr2yaml(str(tmp_path), str(tmp_path / "output.yaml"))
+    assert excinfo.value.code == 1
+    assert "Error al abrir el archivo XML" in capsys.readouterr().out
+
+
+def test_convert_post_content_plain_text():
+    # Content without markup skips the HTML pipeline but is still trimmed
+    assert convert_post_content("Hello\n") == "Hello"
+    assert convert_post_content("x\n\n") == "x"
+    assert convert_post_content("   ") == ""
+    assert convert_post_content("a\r\n\r\n\r\nb\n") == "a\n\nb"
+
+
+def test_parse_wxr2yaml_added_item_field(tmp_path, monkeypatch):
+    # Fields added to ITEM_FIELDS are written like the built-in ones
+    monkeypatch.setitem(
+        wp_export2yaml.ITEM_FIELDS,
+        "{http://wordpress.org/export/1.2/excerpt/}encoded",
+        "excerpt",
+    )
+    xml_file = tmp_path / "export.xml"
+    xml_file.write_text(
+        '<rss xmlns:wp="http://wordpress.org/export/1.2/"'
+        ' xmlns:excerpt="http://wordpress.org/export/1.2/excerpt/"><channel>'
+        "<item><wp:post_id>1</wp:post_id><wp:post_type>post</wp:post_type>"
+        "<excerpt:encoded>one\ntwo</excerpt:encoded></item>"
+        "</channel></rss>"
+    )
+    yaml_file = tmp_path / "output.yaml"
+    parse_wxr2yaml(str(xml_file), str(yaml_file))
+    output = yaml_file.read_text()
+    assert "excerpt: |-\n    one\n    two\n" in output
+    assert yaml.safe_load(output)[0]["excerpt"] == "one\ntwo"
@@ -1,21 +1,18 @@
 import lxml.etree as etree
+import lxml.html as lhtml
 import yaml
 import sys
-import argparse
-from datetime import datetime
 import os
-from markdownify import markdownify as md
-from typing import List, Optional, Dict, Any
-from bs4 import MarkupResemblesLocatorWarning, BeautifulSoup
+from typing import List, Optional, Dict, Any, FrozenSet, Iterable, Iterator, Tuple
 import warnings
 import phpserialize
 import re
 import fnmatch
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict, deque
 
-# Suppress BeautifulSoup warning
-warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
-
-# Define namespaces for lxml XPath
+# Namespaces used in WordPress WXR exports
 NAMESPACES = {
     "excerpt": "http://wordpress.org/export/1.2/excerpt/",
     "content": "http://purl.org/rss/1.0/modules/content/",
@@ -24,15 +21,205 @@ NAMESPACES = {
     "rss": "http://purl.org/rss/1.0/modules/syndication/",
 }
 
+# Clark-notation ({namespace}localname) tags for direct child lookups.
+# find() and tag comparisons with these skip the XPath engine entirely.
+WP_NS = "{%s}" % NAMESPACES["wp"]
+CONTENT_NS = "{%s}" % NAMESPACES["content"]
+TAG_POST_ID = WP_NS + "post_id"
+TAG_POST_NAME = WP_NS + "post_name"
+TAG_POST_TYPE = WP_NS + "post_type"
+TAG_POST_DATE = WP_NS + "post_date"
+TAG_POSTMETA = WP_NS + "postmeta"
+TAG_META_KEY = WP_NS + "meta_key"
+TAG_META_VALUE = WP_NS + "meta_value"
+TAG_CONTENT = CONTENT_NS + "encoded"
+TAG_TITLE = "title"
+TAG_CATEGORY = "category"
+
+# Item children copied to the post, as tag -> post field, in output order.
+# They are all collected in a single pass over the children of each item.
+ITEM_FIELDS = {
+    TAG_POST_ID: "id",
+    TAG_TITLE: "title",
+    TAG_POST_NAME: "slug",  # Slug
+    TAG_POST_TYPE: "post_type",
+    TAG_POST_DATE: "post_date",
+    # Add more fields here if needed
+    TAG_CONTENT: "content",
+}
+
+# Sentinel for dict lookups where None is a valid value
+_MISSING = object()
+
+# Leading characters of PHP serialized values, a cheap check ahead of the regex
+_PHP_SER_PREFIXES = ("a:", "s:", "O:", "i:", "d:", "b:", "N;")
 
-# Custom representer for multiline strings as block scalars
+# Structural prefix of a PHP serialized value. Values that don't match can't
+# be unserialized, so they never reach phpserialize.loads.
+_PHP_SER_RE = re.compile(r'^(?:a:\d+:\{|s:\d+:"|i:-?\d+;|d:[^;]+;|b:[01];|N;|O:\d+:")')
+
+# Tags treated as blocks by wrap_inline_runs_in_paragraphs
+BLOCK_TAGS = frozenset(
+    {
+        "address",
+        "article",
+        "aside",
+        "blockquote",
+        "canvas",
+        "dd",
+        "div",
+        "dl",
+        "dt",
+        "fieldset",
+        "figcaption",
+        "figure",
+        "footer",
+        "form",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "header",
+        "hr",
+        "li",
+        "main",
+        "nav",
+        "noscript",
+        "ol",
+        "output",
+        "p",
+        "pre",
+        "section",
+        "table",
+        "tfoot",
+        "ul",
+        "video",
+    }
+)
+
+# Markdown / HTML clean-up patterns used on every converted post
+_RE_HEAD_LIST = re.compile(r"(?<!\n\n)(^|\n)([#\-])")
+_RE_CRLF = re.compile(r"\r\n?")
+_RE_MULTINL = re.compile(r"\n{3,}")
+# Implicit paragraph breaks: runs of two or more <br>, a <br> followed by a
+# line break, or newlines between two text characters (captured in group 1)
+_RE_PARA_ALL = re.compile(
+    r"(?:<br\s*/?>\s*){2,}|<br\s*/?>\s*[\r\n]+|([^\n>])\n+(?=[^\n<])",
+    re.IGNORECASE,
+)
+
+
+class BlockStr(str):
+    """A string that is emitted as a YAML block scalar."""
+
+    __slots__ = ()
+
+
+def block_str(value):
+    """
+    Marks multiline strings as BlockStr, so the newline check happens once
+    when a value is stored instead of for every string the dumper emits.
+    Any other value is returned unchanged.
+    """
+    if type(value) is str and "\n" in value:
+        return BlockStr(value)
+    return value
+
+
+# Custom representer for multiline strings as block scalars. Plain str values
+# keep the dumper's default representer.
 def str_presenter(dumper, data):
-    if "\n" in data:
-        return dumper.represent_scalar("tag:yaml.org,2002:str", data, style="|")
-    return dumper.represent_scalar("tag:yaml.org,2002:str", data)
+    # The C emitter only accepts exact str scalars
+    return dumper.represent_scalar("tag:yaml.org,2002:str", str(data), style="|")
+
+
+# Prefer the libyaml-backed emitter when PyYAML was built with it
+if not hasattr(yaml, "CSafeDumper"):
+    warnings.warn(
+        "PyYAML was built without libyaml, falling back to the slower "
+        "pure-Python YAML emitter",
+        RuntimeWarning,
+    )
 
 
-yaml.add_representer(str, str_presenter)
+class _YamlDumper(getattr(yaml, "CSafeDumper", yaml.SafeDumper)):
+    # Cached deserialized values can be shared by several fields, which are
+    # still written out in full rather than as YAML aliases
+    def ignore_aliases(self, data):
+        return True
+
+
+yaml.add_representer(BlockStr, str_presenter, Dumper=_YamlDumper)
+
+
+def dump_post(post: Dict[str, Any], outfile) -> None:
+    """
+    Appends a single post to the YAML output as a top-level list item.
+
+    Args:
+        post: The post to write
+        outfile: The open YAML output file
+    """
+    text = yaml.dump(
+        [post],
+        Dumper=_YamlDumper,
+        allow_unicode=True,
+        default_flow_style=False,
+        sort_keys=False,
+    )
+    # A trailing "|+" block scalar makes the emitter end the document with
+    # "...", which would split the output into several documents. The posts
+    # must all be items of the same top-level list.
+    if text.endswith("\n...\n"):
+        text = text[:-4]
+    outfile.write(text)
+
+
+# markdownify options shared by every conversion
+_MD_OPTS = {
+    "heading_style": "ATX",  # Use # style headings
+    "bullets": "-",  # Use - for lists
+    "convert": (
+        "b",
+        "i",
+        "em",
+        "strong",
+        "p",
+        "a",
+        "img",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "ul",
+        "ol",
+        "li",
+        "blockquote",
+        "code",
+        "pre",
+        "br",
+        "hr",
+    ),
+    "autolinks": True,  # Convert URLs to links
+    "default_title": True,  # Use alt text as link title
+    "escape_asterisks": False,  # Don't escape * in text
+    "escape_underscores": False,  # Don't escape _ in text
+    # Keep inline images in paragraphs and list items
+    "keep_inline_images_in": ("p", "li"),
+    "newline_style": "\n",  # Use \n for newlines
+    "strip_links": False,  # Keep links
+    "strip_images": False,  # Keep images
+    "wrap": False,  # Disable line wrapping for more control
+}
+
+# A single converter is reused for every post instead of building a new one
+# (and its conversion function cache) on each call. It is only built once
+# Markdown is actually needed.
+_md_converter = None
 
 
 def convert_html_to_markdown(html_content: str) -> str:
@@ -45,111 +232,103 @@ def convert_html_to_markdown(html_content: str) -> str:
     Returns:
         The converted Markdown content
     """
+    global _md_converter
     if not html_content:
         return ""
 
-    return md(
-        html_content,
-        heading_style="ATX",  # Use # style headings
-        bullets="-",  # Use - for lists
-        convert=[
-            "b",
-            "i",
-            "em",
-            "strong",
-            "p",
-            "a",
-            "img",
-            "h1",
-            "h2",
-            "h3",
-            "h4",
-            "h5",
-            "h6",
-            "ul",
-            "ol",
-            "li",
-            "blockquote",
-            "code",
-            "pre",
-            "br",
-            "hr",
-        ],
-        autolinks=True,  # Convert URLs to links
-        default_title=True,  # Use alt text as link title
-        escape_asterisks=False,  # Don't escape * in text
-        escape_underscores=False,  # Don't escape _ in text
-        keep_inline_images_in=[
-            "p",
-            "li",
-        ],  # Keep inline images in paragraphs and list items
-        newline_style="\n",  # Use \n for newlines
-        strip_links=False,  # Keep links
-        strip_images=False,  # Keep images
-        wrap=True,  # Wrap text
-        wrap_width=80,  # Wrap at 80 characters
-    )
-
+    if _md_converter is None:
+        # markdownify (and BeautifulSoup) are imported on first use, so runs
+        # without Markdown conversion don't pay for loading them
+        from bs4 import MarkupResemblesLocatorWarning
+        from markdownify import MarkdownConverter
 
-def process_gallery_ids(posts_data: List[Dict[str, Any]], post: Dict[str, Any]) -> None:
-    """
-    Processes gallery IDs in a post's custom fields, replacing them with file paths.
+        # Suppress BeautifulSoup warning
+        warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
+        _md_converter = MarkdownConverter(**_MD_OPTS)
+    return _md_converter.convert(html_content)
 
-    Args:
-        posts_data: List of all processed posts
-        post: The current post being processed
-    """
-    if "galeria" not in post["custom_fields"]:
-        return
 
-    gallery_data = post["custom_fields"]["galeria"]
-    if not isinstance(gallery_data, (str, list)):
-        return
+# Helper: Convert dicts with sequential integer keys to lists, at every level.
+# Multiline strings found along the way are marked as block scalars.
+def dict_to_list_if_sequential(d):
+    if type(d) is dict:
+        n = len(d)
+        # Keys must be exactly the ints 0..n-1, in any order (an empty PHP
+        # array is an empty list)
+        if all(i in d for i in range(n)):
+            return [dict_to_list_if_sequential(d[i]) for i in range(n)]
+        return {k: dict_to_list_if_sequential(v) for k, v in d.items()}
+    if type(d) is list:
+        return [dict_to_list_if_sequential(v) for v in d]
+    if type(d) is str and "\n" in d:
+        return BlockStr(d)
+    return d
 
-    # Convert string to list if necessary
-    if isinstance(gallery_data, str):
-        gallery_ids = [id.strip() for id in gallery_data.split(",")]
-    else:
-        gallery_ids = gallery_data
-
-    image_urls = []
-    for attachment_id in gallery_ids:
-        # Find the attachment post
-        attachment = next(
-            (
-                p
-                for p in posts_data
-                if p.get("post_type") == "attachment"
-                and str(p.get("id")) == str(attachment_id)
-            ),
-            None,
-        )
 
-        if attachment and "_wp_attached_file" in attachment["custom_fields"]:
-            image_urls.append(attachment["custom_fields"]["_wp_attached_file"])
-        else:
-            image_urls.append(attachment_id)  # Keep original ID if not found
+# Serialized PHP scalars, which are parsed without going through phpserialize
+_PHP_SCALAR_RE = re.compile(
+    r'(?:i:(-?\d+)|d:(-?[\d.eE+-]+)|b:([01])|(N)|s:(\d+):"(.*)");', re.DOTALL
+)
 
-    post["custom_fields"]["galeria"] = image_urls
 
+def _try_simple_php_unserialize(serialized_string: str) -> Any:
+    """
+    Parses a serialized PHP integer, float, boolean, null or string.
 
-# Helper: Convert dicts with sequential integer keys to lists
-def dict_to_list_if_sequential(d):
-    if isinstance(d, dict):
-        keys = list(d.keys())
-        if keys == list(range(len(keys))):
-            return [d[k] for k in sorted(d.keys())]
-    return d
+    Returns:
+        The parsed value, or _MISSING if the string is not a single scalar
+    """
+    match = _PHP_SCALAR_RE.fullmatch(serialized_string)
+    if match is None:
+        return _MISSING
+    integer, number, boolean, null, length, string = match.groups()
+    if integer is not None:
+        return int(integer)
+    if number is not None:
+        try:
+            return float(number)
+        except ValueError:
+            return _MISSING
+    if boolean is not None:
+        return boolean == "1"
+    if null is not None:
+        return None
+    # The length is in bytes, and must cover the whole payload
+    if len(string.encode("utf-8")) != int(length):
+        return _MISSING
+    return string
+
+
+# Deserialized values by serialized string, as the same values (field
+# settings, galleries...) are often repeated across posts. Long strings are
+# keyed by their hash, and the cache is emptied when it reaches its maximum
+# size to bound memory usage.
+_unserialize_cache: Dict[Any, Any] = {}
+_UNSERIALIZE_CACHE_MAX_SIZE = 4096
+_UNSERIALIZE_CACHE_HASH_MIN_LENGTH = 256
 
 
 def try_php_unserialize(serialized_string: str):
     """
     Attempts to unserialize a PHP serialized string using phpserialize.
     Returns the deserialized Python object, or the original string on failure.
-    Converts dicts with sequential integer keys to lists.
+    Converts dicts with sequential integer keys to lists. Successful results
+    are cached and shared, so they must not be modified.
     """
     if not serialized_string:
         return serialized_string
+    if isinstance(serialized_string, str):
+        result = _try_simple_php_unserialize(serialized_string)
+        if result is not _MISSING:
+            return result
+    key = serialized_string
+    if len(key) >= _UNSERIALIZE_CACHE_HASH_MIN_LENGTH:
+        if isinstance(key, str):
+            key = key.encode("utf-8", errors="replace")
+        key = hashlib.blake2b(key, digest_size=16).digest()
+    cached = _unserialize_cache.get(key, _MISSING)
+    if cached is not _MISSING:
+        return cached
     try:
         # phpserialize.loads expects bytes
         if isinstance(serialized_string, str):
@@ -158,20 +337,23 @@ def try_php_unserialize(serialized_string: str):
             serialized_bytes = serialized_string
         result = phpserialize.loads(serialized_bytes, decode_strings=True)
         # Convert dicts with sequential integer keys to lists
-        return dict_to_list_if_sequential(result)
+        result = dict_to_list_if_sequential(result)
     except Exception as e:
         sys.stderr.write(f"Warning: Failed to unserialize value: {e}\n")
         return serialized_string
+    if len(_unserialize_cache) >= _UNSERIALIZE_CACHE_MAX_SIZE:
+        _unserialize_cache.clear()
+    _unserialize_cache[key] = result
+    return result
 
 
 def postprocess_markdown(md: str) -> str:
     # Insert double newline before headings, lists, and blockquotes if not already present
-    md = re.sub(r"(?<!\n\n)(^|\n)([#\-])", r"\n\n\2", md)
+    md = _RE_HEAD_LIST.sub(r"\n\n\2", md)
     # Normalize line endings
-    md = md.replace("\r\n", "\n").replace("\r", "\n")
+    md = _RE_CRLF.sub("\n", md)
     # Remove more than two consecutive newlines
-    while "\n\n\n" in md:
-        md = md.replace("\n\n\n", "\n\n")
+    md = _RE_MULTINL.sub("\n\n", md)
     return md.strip()
 
 
@@ -180,82 +362,57 @@ def wrap_inline_runs_in_paragraphs(html: str) -> str:
     Group runs of inline elements and text nodes at the top level into a single <p>.
     Only true block elements remain as separate blocks.
     """
-    soup = BeautifulSoup(html, "html.parser")
-    block_tags = {
-        "address",
-        "article",
-        "aside",
-        "blockquote",
-        "canvas",
-        "dd",
-        "div",
-        "dl",
-        "dt",
-        "fieldset",
-        "figcaption",
-        "figure",
-        "footer",
-        "form",
-        "h1",
-        "h2",
-        "h3",
-        "h4",
-        "h5",
-        "h6",
-        "header",
-        "hr",
-        "li",
-        "main",
-        "nav",
-        "noscript",
-        "ol",
-        "output",
-        "p",
-        "pre",
-        "section",
-        "table",
-        "tfoot",
-        "ul",
-        "video",
-    }
-    container = soup.body if soup.body else soup
-    new_children = []
-    buffer = []
-    for child in list(container.children):
+    if not html.strip():
+        return html
+    root = lhtml.fragment_fromstring(html, create_parent="div")
+    wrapped = lhtml.Element("div")
+    buffer = None  # <p> collecting the current run of inline content
+
+    def buffer_text(text):
+        nonlocal buffer
+        if buffer is None:
+            buffer = lhtml.Element("p")
+        if len(buffer):
+            buffer[-1].tail = (buffer[-1].tail or "") + text
+        else:
+            buffer.text = (buffer.text or "") + text
+
+    # Text before the first child starts an inline run
+    if root.text:
+        buffer_text(root.text)
+    for child in list(root):
+        # The tail text belongs to the surrounding run, not to the child
+        tail = child.tail
+        child.tail = None
         # If it's a block element, flush buffer and add block
-        if getattr(child, "name", None) in block_tags:
-            if buffer:
-                p = soup.new_tag("p")
-                for item in buffer:
-                    p.append(item)
-                new_children.append(p)
-                buffer = []
-            new_children.append(child)
-        # If it's a text node or inline element, buffer it
-        elif getattr(child, "name", None) is None or child.name not in block_tags:
+        if child.tag in BLOCK_TAGS:
+            if buffer is not None:
+                wrapped.append(buffer)
+                buffer = None
+            wrapped.append(child)
+        # If it's an inline element (or a comment), buffer it
+        else:
+            if buffer is None:
+                buffer = lhtml.Element("p")
             buffer.append(child)
+        if tail:
+            buffer_text(tail)
     # Flush any remaining buffer
-    if buffer:
-        p = soup.new_tag("p")
-        for item in buffer:
-            p.append(item)
-        new_children.append(p)
-    # Replace children
-    container.clear()
-    for item in new_children:
-        container.append(item)
-    return str(soup)
+    if buffer is not None:
+        wrapped.append(buffer)
+    # Strip the wrapping <div> and </div>
+    return lhtml.tostring(wrapped, encoding="unicode")[5:-6]
+
+
+def _paragraph_break(match: re.Match) -> str:
+    text = match.group(1)
+    return "</p><p>" if text is None else text + "</p><p>"
 
 
 def html_paragraphize(html: str) -> str:
-    # Convert two or more consecutive newlines between text to paragraph breaks
-    html = re.sub(r"([^\n>])\n{2,}([^\n<])", r"\1</p><p>\2", html)
-    # Convert a single newline between text to paragraph break
-    html = re.sub(r"([^\n>])\n([^\n<])", r"\1</p><p>\2", html)
-    # Replace two or more consecutive <br> tags with paragraph breaks
-    html = re.sub(r"(<br\s*/?>\s*){2,}", "</p><p>", html, flags=re.IGNORECASE)
-    # Replace <br> followed by a newline with paragraph break
-    html = re.sub(r"<br\s*/?>\s*[\r\n]+", "</p><p>", html, flags=re.IGNORECASE)
+    # Convert newlines between text, runs of <br> tags and <br> followed by a
+    # newline to paragraph breaks, all in a single pass
+    html = _RE_PARA_ALL.sub(_paragraph_break, html)
     # Ensure the HTML starts and ends with a <p> for proper grouping
     html = html.strip()
     if not html.lower().startswith("<p>"):
@@ -265,6 +422,223 @@ def html_paragraphize(html: str) -> str:
     return html
 
 
+# Posts are converted to Markdown in batches of this size, and sent to the
+# worker processes in chunks of _MARKDOWN_CHUNKSIZE contents
+_MARKDOWN_BATCH_SIZE = 512
+_MARKDOWN_CHUNKSIZE = 32
+# Batches converted by the worker processes while the export is still parsed.
+# Beyond this the parsing waits for the oldest batch, bounding memory usage.
+_MARKDOWN_BATCHES_IN_FLIGHT = 2
+
+
+def convert_post_content(content: str) -> str:
+    """
+    Converts the HTML content of a post to Markdown. Defined at module level
+    so it can be run in worker processes.
+
+    Args:
+        content: The raw post content
+
+    Returns:
+        The Markdown content
+    """
+    if "<" in content or "&" in content:
+        # Preprocess HTML to convert implicit paragraphs to explicit ones
+        para_html = html_paragraphize(content)
+        preprocessed_html = wrap_inline_runs_in_paragraphs(para_html)
+        return postprocess_markdown(convert_html_to_markdown(preprocessed_html))
+    if "\r" in content or "\n\n\n" in content:
+        # No markup to convert; only normalize the line breaks
+        return postprocess_markdown(content)
+    # Trimmed like the output of postprocess_markdown
+    return content.strip()
+
+
+def convert_contents(
+    posts: List[Dict[str, Any]], pool: Optional[ProcessPoolExecutor] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Converts the content of a batch of posts to Markdown in place. With a
+    pool, the HTML conversions are submitted right away and run in the worker
+    processes while the caller goes on.
+
+    Args:
+        posts: The posts to convert
+        pool: Process pool to run the HTML conversions in (None to convert
+            in this process)
+
+    Returns:
+        An iterator over the posts, which waits for the conversions to finish
+    """
+    html_posts = []
+    for post in posts:
+        content = post["content"]
+        if "<" in content or "&" in content:
+            html_posts.append(post)
+        else:
+            # Plain text is cheap to handle here, not worth pickling
+            post["content"] = block_str(convert_post_content(content))
+    contents = [post["content"] for post in html_posts]
+    if pool is not None:
+        converted = pool.map(
+            convert_post_content, contents, chunksize=_MARKDOWN_CHUNKSIZE
+        )
+    else:
+        converted = map(convert_post_content, contents)
+    return _converted_posts(posts, html_posts, converted)
+
+
+def _converted_posts(
+    posts: List[Dict[str, Any]],
+    html_posts: List[Dict[str, Any]],
+    converted: Iterable[str],
+) -> Iterator[Dict[str, Any]]:
+    for post, content in zip(html_posts, converted):
+        post["content"] = block_str(content)
+    yield from posts
+
+
+def compile_field_patterns(
+    patterns: Iterable[str],
+) -> Tuple[FrozenSet[str], Optional[re.Pattern]]:
+    """
+    Splits custom field patterns into exact names and wildcard patterns.
+
+    Args:
+        patterns: Field names, optionally with fnmatch wildcards (*, ?, [...])
+
+    Returns:
+        The set of exact names, and a regex matching any of the wildcard
+        patterns (None if there are none)
+    """
+    patterns = tuple(patterns)
+    names = frozenset(p for p in patterns if not any(c in p for c in "*?["))
+    wildcards = [fnmatch.translate(p) for p in patterns if p not in names]
+    return names, re.compile("|".join(wildcards)) if wildcards else None
+
+
+def collapse_custom_fields(meta_values: Dict[str, List[Any]]) -> Dict[str, Any]:
+    """
+    Builds the custom fields of a post from the values collected for each
+    meta key. Keys with a single value keep that value, and the values of
+    repeated keys are kept in a list.
+
+    Args:
+        meta_values: The values of each meta key, in document order
+
+    Returns:
+        The custom fields
+    """
+    custom_fields = {}
+    for meta_key, values in meta_values.items():
+        if len(values) == 1:
+            custom_fields[meta_key] = values[0]
+        elif type(values[0]) is list:
+            # A leading list value is extended with the repeated values.
+            # Deserialized lists are shared with the cache, so copy it.
+            custom_fields[meta_key] = values[0] + values[1:]
+        else:
+            custom_fields[meta_key] = values
+    return custom_fields
+
+
+def find_attached_file(postmetas: Iterable[Any]) -> Any:
+    """
+    Returns the _wp_attached_file meta value of an attachment item without
+    processing the rest of the item.
+
+    Args:
+        postmetas: The <wp:postmeta> elements of the attachment item
+
+    Returns:
+        The attached file path, or _MISSING if the item has none
+    """
+    for postmeta in postmetas:
+        if postmeta.findtext(TAG_META_KEY) == "_wp_attached_file":
+            meta_value_elem = postmeta.find(TAG_META_VALUE)
+            if meta_value_elem is not None:
+                return meta_value_elem.text
+    return _MISSING
+
+
+def resolve_attachment_ids(
+    post: Dict[str, Any], attached_files: Dict[str, Any], allow_missing: bool = True
+) -> bool:
+    """
+    Replaces the gallery and thumbnail attachment IDs of a post with the
+    attached file paths.
+
+    Args:
+        post: The post to update
+        attached_files: Mapping of attachment IDs to their attached file path
+        allow_missing: Whether to keep the IDs of attachments that are not
+            found; otherwise the post is only updated if every one is found
+
+    Returns:
+        Whether the post was updated
+    """
+    custom_fields = post["custom_fields"]
+    # Process galeria
+    gallery_ids = None
+    if "galeria" in custom_fields:
+        # Serialized galleries were already turned into lists when parsed
+        gallery_data = custom_fields["galeria"]
+        # Convert string to list if necessary. An empty gallery has no IDs,
+        # and a single ID needs no splitting.
+        if isinstance(gallery_data, str):
+            if not gallery_data:
+                gallery_ids = []
+            elif "," not in gallery_data:
+                gallery_ids = [gallery_data.strip()]
+            else:
+                gallery_ids = [id.strip() for id in gallery_data.split(",")]
+        elif isinstance(gallery_data, list):
+            gallery_ids = gallery_data
+    # Process _thumbnail_id
+    thumb_id = _MISSING
+    if "_thumbnail_id" in custom_fields:
+        thumb_id = custom_fields["_thumbnail_id"]
+        # If it's a list, take the first element
+        if isinstance(thumb_id, list) and thumb_id:
+            thumb_id = thumb_id[0]
+
+    if not allow_missing:
+        if gallery_ids is not None and not all(
+            str(attachment_id) in attached_files for attachment_id in gallery_ids
+        ):
+            return False
+        if thumb_id is not _MISSING and str(thumb_id) not in attached_files:
+            return False
+
+    if gallery_ids is not None:
+        # Keep the original ID if the attachment is not found
+        custom_fields["galeria"] = [
+            attached_files.get(str(attachment_id), attachment_id)
+            for attachment_id in gallery_ids
+        ]
+    if thumb_id is not _MISSING:
+        custom_fields["thumbnail"] = attached_files.get(str(thumb_id), thumb_id)
+        # Remove the original _thumbnail_id field
+        del custom_fields["_thumbnail_id"]
+    return True
+
+
+# Buffer size used to read the XML export
+_XML_READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Exports up to this size are parsed into a full tree instead of incrementally
+_XML_WALK_MAX_SIZE = 64 * 1024 * 1024
+
+# Parser options for both parsing modes. Blank text and comments are dropped
+# at parse time so they are never materialized.
+_XML_PARSER_OPTIONS = {
+    "recover": True,
+    "huge_tree": True,
+    "remove_blank_text": True,
+    "remove_comments": True,
+}
+
+
 def parse_wxr2yaml(
     xml_filepath: str,
     yaml_filepath: str,
@@ -282,101 +656,129 @@ def parse_wxr2yaml(
         excluded_custom_fields: List of custom fields to exclude
         convert_to_markdown: Whether to convert HTML content to Markdown
     """
-    posts_data = []
-    attachments = {}  # Dictionary to store attachment data
+    # Attachment ID -> attached file path, for gallery/thumbnail resolution
+    attached_files: Dict[str, Any] = {}
+    # Posts referencing attachments that have not been seen yet are held back
+    # until the end; everything else is written out as soon as it is parsed
+    deferred_posts = []
+    posts_written = 0
 
     try:
-        # Use iterparse to process the XML element by element
-        context = etree.iterparse(
-            xml_filepath, events=("end",), tag="item", recover=True
-        )
+        # Read the export in large sequential chunks
+        xml_file = open(xml_filepath, "rb", buffering=_XML_READ_BUFFER_SIZE)
+    except FileNotFoundError:
+        print(f"Error: El archivo XML no fue encontrado en {xml_filepath}")
+        sys.exit(1)
+    except OSError as e:
+        print(f"Error al abrir el archivo XML {xml_filepath}: {e}")
+        sys.exit(1)
+
+    # Excluded field names are matched with a set lookup, and the wildcard
+    # patterns with a single precompiled regex
+    excluded_names, excluded_regex = compile_field_patterns(
+        excluded_custom_fields or ()
+    )
+
+    # Bind the lookups used on every postmeta to locals for the item loop
+    match_excluded = excluded_regex.match if excluded_regex else None
+    match_php_serialized = _PHP_SER_RE.match
+    unserialize = try_php_unserialize
+    item_fields = ITEM_FIELDS
+    field_names = tuple(ITEM_FIELDS.values())
 
-        print(f"Iniciando parseo de {xml_filepath} con lxml iterparse...")
+    # Whether the attached file of attachments is dropped from the output
+    attached_file_excluded = "_wp_attached_file" in excluded_names or bool(
+        match_excluded and match_excluded("_wp_attached_file")
+    )
+
+    # Posts waiting for their content to be converted to Markdown
+    batch = []
+    # Batches being converted, in output order
+    in_flight = deque()
+    pool = None
+
+    outfile = None
+    try:
+        outfile = open(yaml_filepath, "w", encoding="utf-8")
+
+        # Markdown conversion is CPU bound and independent for each post, so
+        # spread it across processes when there is more than one core. The
+        # pool is only started once a full batch is ready, so exports smaller
+        # than a batch don't pay for starting the worker processes.
+        use_pool = convert_to_markdown and (os.cpu_count() or 1) > 1
+
+        def write_post(post):
+            nonlocal posts_written
+            dump_post(post, outfile)
+            posts_written += 1
+
+        # Exports that comfortably fit in memory are parsed at once and the
+        # tree is walked, which is faster than parsing incrementally. Larger
+        # ones are parsed item by item, dropping each item once processed.
+        walk_tree = os.fstat(xml_file.fileno()).st_size <= _XML_WALK_MAX_SIZE
+        if walk_tree:
+            print(f"Iniciando parseo de {xml_filepath} con lxml parse...")
+            tree = etree.parse(xml_file, etree.XMLParser(**_XML_PARSER_OPTIONS))
+            root = tree.getroot()
+            # The recovering parser returns a tree without a root for input
+            # that has no XML at all, which then simply has no items
+            if root is None:
+                context = ()
+            else:
+                context = etree.iterwalk(root, events=("end",), tag="item")
+        else:
+            print(f"Iniciando parseo de {xml_filepath} con lxml iterparse...")
+            context = etree.iterparse(
+                xml_file, events=("end",), tag="item", **_XML_PARSER_OPTIONS
+            )
+        print(f"Escribiendo datos en {yaml_filepath}...")
 
-        # First pass: collect all posts and attachments
+        # First pass: write out posts and collect attachments
         for event, item in context:
             try:
-                post = {}
-
-                # Helper to safely get text using xpath and namespaces
-                def get_text(xpath_expr):
-                    elements = item.xpath(xpath_expr, namespaces=NAMESPACES)
-                    if not elements or elements[0].text is None:
-                        return None
-                    # Ensure we return a string, not bytes
-                    text = elements[0].text
-                    if isinstance(text, bytes):
-                        return text.decode("utf-8", errors="replace")
-                    return text
-
-                # Extract basic fields using xpath
-                # Extract WordPress specific fields using xpath with wp namespace
-                post["id"] = get_text("wp:post_id")
-                post["title"] = get_text("title")
-                post["slug"] = get_text("wp:post_name")  # Slug
-                post["post_type"] = get_text("wp:post_type")
-                post["post_date"] = get_text("wp:post_date")
-                # post['link'] = get_text('link')
-                # post['status'] = get_text('wp:status')
-                # post['post_parent'] = get_text('wp:post_parent')
-                # post['menu_order'] = get_text('wp:menu_order')
-                # Add more fields here if needed
+                # Extract the basic fields with one pass over the children,
+                # keeping the categories and postmeta for later
+                post = dict.fromkeys(field_names)
+                categories = []
+                postmetas = []
+                for child in item:
+                    tag = child.tag
+                    name = item_fields.get(tag)
+                    if name is not None:
+                        post[name] = block_str(child.text)
+                    elif tag == TAG_POSTMETA:
+                        postmetas.append(child)
+                    elif tag == TAG_CATEGORY:
+                        categories.append(child)
+
+                # Items of types that are not exported only matter for the
+                # attachment files they provide, so skip all the other work
+                post_type = post["post_type"]
+                if included_post_types is not None and (
+                    post_type not in included_post_types
+                ):
+                    if post_type == "attachment" and not attached_file_excluded:
+                        attached_file = find_attached_file(postmetas)
+                        if attached_file is not _MISSING:
+                            attached_files[post["id"]] = attached_file
+                    continue
 
                 # Process content
-                post["content"] = get_text("content:encoded")
                 # Ensure content is always a string
-                if post["content"] is None:
-                    post["content"] = ""
-                # Convert content to Markdown if requested
-                if convert_to_markdown and post["content"]:
-                    # Preprocess HTML to convert implicit paragraphs to explicit ones
-                    para_html = html_paragraphize(post["content"])
-                    preprocessed_html = wrap_inline_runs_in_paragraphs(para_html)
-                    post["content"] = md(
-                        preprocessed_html,
-                        heading_style="ATX",
-                        bullets="-",
-                        convert=[
-                            "b",
-                            "i",
-                            "em",
-                            "strong",
-                            "p",
-                            "a",
-                            "img",
-                            "h1",
-                            "h2",
-                            "h3",
-                            "h4",
-                            "h5",
-                            "h6",
-                            "ul",
-                            "ol",
-                            "li",
-                            "blockquote",
-                            "code",
-                            "pre",
-                            "br",
-                            "hr",
-                        ],
-                        autolinks=True,
-                        default_title=True,
-                        escape_asterisks=False,
-                        escape_underscores=False,
-                        keep_inline_images_in=["p", "li"],
-                        newline_style="\n",
-                        strip_links=False,
-                        strip_images=False,
-                        wrap=False,  # Disable line wrapping for more control
-                    )
-                    post["content"] = postprocess_markdown(post["content"])
+                content = post["content"] or ""
+                # Content to convert to Markdown is kept raw until its batch
+                # is converted
+                if convert_to_markdown:
+                    post["content"] = content
+                else:
+                    post["content"] = block_str(content)
 
                 # Extract taxonomies
                 post["taxonomies"] = {}
-                for category in item.xpath("category"):
+                for category in categories:
                     domain = category.get("domain")
                     nicename = category.get("nicename")
-                    term_name = category.text
+                    term_name = block_str(category.text)
 
                     if domain and nicename is not None:
                         if domain not in post["taxonomies"]:
@@ -387,10 +789,11 @@ def parse_wxr2yaml(
                         )
 
                 # Extract metadata and custom fields using wp:postmeta
-                post["custom_fields"] = {}
-                for postmeta in item.xpath("wp:postmeta", namespaces=NAMESPACES):
-                    meta_key_elem = postmeta.find("wp:meta_key", NAMESPACES)
-                    meta_value_elem = postmeta.find("wp:meta_value", NAMESPACES)
+                # Values are collected per key first, as keys can be repeated
+                meta_values = defaultdict(list)
+                for postmeta in postmetas:
+                    meta_key_elem = postmeta.find(TAG_META_KEY)
+                    meta_value_elem = postmeta.find(TAG_META_VALUE)
 
                     if (
                         meta_key_elem is not None
@@ -400,22 +803,13 @@ def parse_wxr2yaml(
                         meta_key = meta_key_elem.text
 
                         # Skip excluded custom fields (support wildcards)
-                        if excluded_custom_fields and any(
-                            fnmatch.fnmatch(meta_key, pattern)
-                            for pattern in excluded_custom_fields
+                        if meta_key in excluded_names or (
+                            match_excluded and match_excluded(meta_key)
                         ):
                             continue
 
-                        meta_value_raw = meta_value_elem.text  # Can be None if empty
-
-                        # Ensure meta_value_raw is a string
-                        if meta_value_raw is not None:
-                            if isinstance(meta_value_raw, bytes):
-                                meta_value_raw = meta_value_raw.decode(
-                                    "utf-8", errors="replace"
-                                )
-                            elif not isinstance(meta_value_raw, str):
-                                meta_value_raw = str(meta_value_raw)
+                        # lxml text is always a str, or None if empty
+                        meta_value_raw = meta_value_elem.text
 
                         # --- Attempt PHP Deserialization ---
                         meta_value_processed = meta_value_raw
@@ -423,14 +817,13 @@ def parse_wxr2yaml(
                         # Heuristic: Does it look like PHP serialized data?
                         if (
                             meta_value_raw
-                            and isinstance(meta_value_raw, str)
-                            and len(meta_value_raw) > 2
-                            and meta_value_raw[0] in ("a", "s", "O", "i", "d", "b", "N")
-                            and meta_value_raw[1] == ":"
+                            and meta_value_raw.startswith(_PHP_SER_PREFIXES)
+                            and match_php_serialized(meta_value_raw)
                         ):
 
-                            # Try to deserialize using phpserialize
-                            deserialized_result = try_php_unserialize(meta_value_raw)
+                            # Try to deserialize using phpserialize (this also
+                            # converts sequential dicts to lists)
+                            deserialized_result = unserialize(meta_value_raw)
 
                             # Check the result from the unserialization
                             if (
@@ -445,127 +838,107 @@ def parse_wxr2yaml(
                                     meta_value_raw  # Keep raw string on failure
                                 )
 
-                        # Always convert dicts with sequential integer keys to lists for all custom fields
-                        meta_value_processed = dict_to_list_if_sequential(
-                            meta_value_processed
-                        )
-
-                        # Store the processed value
-                        if meta_key in post["custom_fields"]:
-                            current_value = post["custom_fields"][meta_key]
-                            if not isinstance(current_value, list):
-                                post["custom_fields"][meta_key] = [
-                                    current_value,
-                                    meta_value_processed,
-                                ]
-                            else:
-                                post["custom_fields"][meta_key].append(
-                                    meta_value_processed
-                                )
-                        else:
-                            post["custom_fields"][meta_key] = meta_value_processed
+                        # Multiline strings are emitted as block scalars
+                        # (deserialized values are already marked)
+                        if type(meta_value_processed) is str:
+                            meta_value_processed = block_str(meta_value_processed)
 
-                # Always collect attachments for gallery resolution
-                if post["post_type"] == "attachment":
-                    attachments[post["id"]] = post
+                        meta_values[meta_key].append(meta_value_processed)
+                post["custom_fields"] = custom_fields = collapse_custom_fields(
+                    meta_values
+                )
 
-                # Only add to posts_data if included_post_types is None or matches
-                if (included_post_types is None) or (
-                    post["post_type"] in included_post_types
+                # Always collect attachment files for gallery resolution
+                if (
+                    post["post_type"] == "attachment"
+                    and "_wp_attached_file" in custom_fields
+                ):
+                    attached_files[post["id"]] = custom_fields["_wp_attached_file"]
+
+                # Attachments usually come before the posts using them, so most
+                # references can be resolved right away. This is decided as
+                # soon as the post is parsed, so which posts are deferred
+                # doesn't depend on how far the Markdown conversion lags.
+                if (
+                    "galeria" in custom_fields or "_thumbnail_id" in custom_fields
+                ) and not resolve_attachment_ids(
+                    post, attached_files, allow_missing=False
                 ):
-                    posts_data.append(post)
+                    deferred_posts.append(post)
+                elif convert_to_markdown:
+                    batch.append(post)
+                    if len(batch) >= _MARKDOWN_BATCH_SIZE:
+                        if pool is None and use_pool:
+                            pool = ProcessPoolExecutor()
+                        in_flight.append(convert_contents(batch, pool))
+                        batch = []
+                        # Parsing goes on while the pool converts the batches,
+                        # writing out the oldest ones past the limit
+                        max_in_flight = (
+                            _MARKDOWN_BATCHES_IN_FLIGHT if pool is not None else 0
+                        )
+                        while len(in_flight) > max_in_flight:
+                            for post in in_flight.popleft():
+                                write_post(post)
+                else:
+                    write_post(post)
 
             finally:
-                # Clean up the element and its ancestors
-                item.clear()
-                # Remove references to previous siblings
-                prev = item.getprevious()
-                if prev is not None:
-                    item.getparent().remove(prev)
-                # Remove the current element
-                if item.getparent() is not None:
-                    item.getparent().remove(item)
-
-        print(f"Parseo completado. {len(posts_data)} ítems procesados.")
-
-        # Second pass: process gallery IDs and _thumbnail_id
+                # Clean up the element and drop the already processed
+                # siblings before it, keeping memory usage constant. A walked
+                # tree is kept whole.
+                if not walk_tree:
+                    item.clear()
+                    parent = item.getparent()
+                    while item.getprevious() is not None:
+                        del parent[0]
+
+        # Convert the last, partial batch, in this process if no pool was
+        # needed so far
+        in_flight.append(convert_contents(batch, pool))
+        while in_flight:
+            for post in in_flight.popleft():
+                write_post(post)
+        # The deferred posts are converted along with their resolution
+        if convert_to_markdown:
+            deferred_posts = list(convert_contents(deferred_posts, pool))
+
+        print(
+            f"Parseo completado. {posts_written + len(deferred_posts)} ítems procesados."
+        )
+
+        # Second pass: process the gallery IDs and _thumbnail_id of the posts
+        # whose attachments were not found while parsing
         print("Procesando IDs de galería y miniaturas...")
-        for post in posts_data:
-            # Process galeria
-            if "galeria" in post["custom_fields"]:
-                gallery_data = post["custom_fields"]["galeria"]
-                # Always convert dicts with sequential integer keys to lists
-                gallery_data = dict_to_list_if_sequential(gallery_data)
-                if not isinstance(gallery_data, (str, list)):
-                    continue
-                # Convert string to list if necessary
-                if isinstance(gallery_data, str):
-                    gallery_ids = [id.strip() for id in gallery_data.split(",")]
-                else:
-                    gallery_ids = gallery_data
-                image_urls = []
-                for attachment_id in gallery_ids:
-                    # Find the attachment in our dictionary
-                    attachment = attachments.get(str(attachment_id))
-                    if (
-                        attachment
-                        and "_wp_attached_file" in attachment["custom_fields"]
-                    ):
-                        image_urls.append(
-                            attachment["custom_fields"]["_wp_attached_file"]
-                        )
-                    else:
-                        image_urls.append(
-                            attachment_id
-                        )  # Keep original ID if not found
-                post["custom_fields"]["galeria"] = image_urls
-            # Process _thumbnail_id
-            if "_thumbnail_id" in post["custom_fields"]:
-                thumb_id = post["custom_fields"]["_thumbnail_id"]
-                # If it's a list, take the first element
-                if isinstance(thumb_id, list) and thumb_id:
-                    thumb_id = thumb_id[0]
-                attachment = attachments.get(str(thumb_id))
-                if attachment and "_wp_attached_file" in attachment["custom_fields"]:
-                    post["custom_fields"]["thumbnail"] = attachment["custom_fields"][
-                        "_wp_attached_file"
-                    ]
-                else:
-                    post["custom_fields"]["thumbnail"] = thumb_id
-                # Remove the original _thumbnail_id field
-                del post["custom_fields"]["_thumbnail_id"]
+        for post in deferred_posts:
+            resolve_attachment_ids(post, attached_files)
+            dump_post(post, outfile)
+            posts_written += 1
+
+        # Keep the output a valid (empty) YAML list when nothing matched
+        if not posts_written:
+            outfile.write("[]\n")
 
-    except FileNotFoundError:
-        print(f"Error: El archivo XML no fue encontrado en {xml_filepath}")
-        sys.exit(1)
     except etree.XMLSyntaxError as e:
         print(f"Error al parsear el archivo XML (lxml): {e}")
         print(
             "Asegúrate de que el archivo es un XML de exportación de WordPress válido y bien formado."
         )
         sys.exit(1)
+    except IOError as e:
+        print(f"Error al escribir el archivo YAML: {e}")
+        sys.exit(1)
     except Exception as e:
         print(f"Ocurrió un error inesperado durante el parseo: {e}")
         import traceback
 
         traceback.print_exc()
         sys.exit(1)
-
-    # Write to YAML file
-    try:
-        print(f"Escribiendo datos en {yaml_filepath}...")
-        with open(yaml_filepath, "w", encoding="utf-8") as outfile:
-            yaml.dump(
-                posts_data,
-                outfile,
-                allow_unicode=True,
-                default_flow_style=False,
-                sort_keys=False,
-            )
-        print(f"Archivo YAML guardado exitosamente en {yaml_filepath}.")
-    except IOError as e:
-        print(f"Error al escribir el archivo YAML: {e}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Ocurrió un error inesperado al escribir el archivo YAML: {e}")
-        sys.exit(1)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if outfile is not None:
+            outfile.close()
+        xml_file.close()
+
+    print(f"Archivo YAML guardado exitosamente en {yaml_filepath}.")